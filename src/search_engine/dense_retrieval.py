@@ -0,0 +1,273 @@
+from search_engine.inverted_index import InvertedIndex
+from search_engine.vector_space_model import VectorSpaceModel
+from search_engine.okapi_bm25 import OkapiBM25
+from typing import List, Tuple, Dict, Counter
+import threading
+import tempfile
+import numpy
+import math
+
+class DenseRetrieval:
+    """Dense retrieval over LSA (truncated SVD of TF-IDF) embeddings with an IVF index"""
+
+    def __init__(self, inverted_index: InvertedIndex, vsm: VectorSpaceModel, dimensions: int = 128,
+                 n_lists: int = None, n_probe: int = 8, path: str = None, seed: int = 42):
+        self.index = inverted_index
+        self.vsm = vsm
+        self.dimensions = dimensions
+        self.n_lists = n_lists  # Number of IVF clusters, defaults to sqrt(#docs)
+        self.n_probe = n_probe  # Clusters scanned per query, higher is slower but more exact
+        self.path = path
+        self.seed = seed
+        self.doc_ids = []
+        self.term_ids = {}
+        self.term_projection = None  # (terms x dimensions) maps TF-IDF space to LSA space
+        self.embeddings = None  # (docs x dimensions) float32 memory-mapped matrix
+        self.centroids = None
+        self.inverted_lists = []
+        self._embeddings_file = None
+        self._build_lock = threading.Lock()
+        self._built = False
+
+    def build(self):
+        """Compute document embeddings and the IVF index"""
+        doc_ids = list(self.index.doc_lengths.keys())
+        term_ids = {term: i for i, term in enumerate(sorted(self.index.doc_frequencies.keys()))}
+
+        if not doc_ids or not term_ids:
+            self.doc_ids, self.term_ids = doc_ids, term_ids
+            return
+
+        # Sparse (row, column, value) TF-IDF document-term matrix, same weighting as the VSM
+        rows, cols, values = [], [], []
+        for row, doc_id in enumerate(doc_ids):
+            for term, tf in self.index.doc_terms[doc_id].items():
+                rows.append(row)
+                cols.append(term_ids[term])
+                values.append((1 + math.log(tf)) * self.vsm.compute_idf(term))
+
+        rows = numpy.array(rows, dtype=numpy.int64)
+        cols = numpy.array(cols, dtype=numpy.int64)
+        values = numpy.array(values, dtype=numpy.float64)
+        n_docs, n_terms = len(doc_ids), len(term_ids)
+
+        # Length normalize the rows
+        norms = numpy.sqrt(numpy.bincount(rows, weights=values ** 2, minlength=n_docs))
+        values /= numpy.where(norms > 0, norms, 1)[rows]
+
+        u, singular_values, v = self._randomized_svd(rows, cols, values, n_docs, n_terms)
+
+        # A document embeds as A V = U S and a query as q V
+        self.term_projection = v.astype(numpy.float32)
+        embeddings = self._normalize(u * singular_values)
+
+        if self.path is None:
+            # Anonymous file, removed by the OS once closed
+            self._embeddings_file = tempfile.TemporaryFile()
+            self.embeddings = numpy.memmap(self._embeddings_file, mode='w+', dtype=numpy.float32,
+                                           shape=embeddings.shape)
+        else:
+            self.embeddings = numpy.lib.format.open_memmap(self.path, mode='w+', dtype=numpy.float32,
+                                                           shape=embeddings.shape)
+        self.embeddings[:] = embeddings
+        self.embeddings.flush()
+
+        self.doc_ids, self.term_ids = doc_ids, term_ids
+        self.build_ivf()
+
+    def _randomized_svd(self, rows, cols, values, n_docs: int, n_terms: int,
+                        oversampling: int = 10, power_iterations: int = 4):
+        """
+        Truncated SVD of a sparse matrix by random projection (Halko et al.), only
+        ever holding (docs x k) and (terms x k) dense matrices.
+
+        Returns:
+            (U, S, V) with the top self.dimensions singular triplets.
+        """
+
+        rng = numpy.random.default_rng(self.seed)
+        sketch_size = min(self.dimensions + oversampling, n_docs, n_terms)
+
+        def times(dense):  # A @ dense
+            return self._sparse_product(rows, cols, values, dense, n_docs)
+
+        def transposed_times(dense):  # A^T @ dense
+            return self._sparse_product(cols, rows, values, dense, n_terms)
+
+        basis, _ = numpy.linalg.qr(times(rng.standard_normal((n_terms, sketch_size))))
+        for _ in range(power_iterations):
+            projected, _ = numpy.linalg.qr(transposed_times(basis))
+            basis, _ = numpy.linalg.qr(times(projected))
+
+        # B = Q^T A is small, (sketch x terms)
+        small_u, singular_values, vt = numpy.linalg.svd(transposed_times(basis).T, full_matrices=False)
+
+        keep = numpy.flatnonzero(singular_values[:self.dimensions] > 1e-10)
+        return (basis @ small_u)[:, keep], singular_values[keep], vt[keep].T
+
+    @staticmethod
+    def _sparse_product(out_index, in_index, values, dense, size: int):
+        """Multiply a sparse (row, column, value) matrix by a dense one, column by column"""
+        result = numpy.empty((size, dense.shape[1]))
+        for column in range(dense.shape[1]):
+            result[:, column] = numpy.bincount(out_index, weights=values * dense[in_index, column],
+                                               minlength=size)
+        return result
+
+    def ensure_built(self):
+        """Build the model on first use, so engines that never use it pay nothing"""
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self.build()
+                    self._built = True
+
+    def close(self):
+        """Release the embedding matrix and its backing file"""
+        self.embeddings = None
+        self.term_projection = None
+        self._built = False
+        if self._embeddings_file is not None:
+            self._embeddings_file.close()
+            self._embeddings_file = None
+
+    def build_ivf(self, iterations: int = 10):
+        """Cluster the embeddings with spherical k-means into inverted lists"""
+        n_docs = len(self.doc_ids)
+        n_lists = min(n_docs, self.n_lists or max(1, int(math.sqrt(n_docs))))
+
+        rng = numpy.random.default_rng(self.seed)
+        centroids = numpy.array(self.embeddings[rng.choice(n_docs, n_lists, replace=False)])
+
+        for _ in range(iterations):
+            assignment = numpy.argmax(self.embeddings @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = self.embeddings[assignment == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+
+            centroids = self._normalize(centroids)
+
+        assignment = numpy.argmax(self.embeddings @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.inverted_lists = [numpy.flatnonzero(assignment == cluster) for cluster in range(n_lists)]
+
+    def embed_query(self, query_terms: List[str]):
+        """Fold a query into the embedding space, None if no query term is known"""
+        self.ensure_built()
+        if self.term_projection is None:
+            return None
+
+        query_vector = numpy.zeros(self.term_projection.shape[1], dtype=numpy.float32)
+        for term, freq in Counter(query_terms).items():
+            if term in self.term_ids:
+                weight = (1 + math.log(freq)) * self.vsm.compute_idf(term)
+                query_vector += weight * self.term_projection[self.term_ids[term]]
+
+        norm = numpy.linalg.norm(query_vector)
+        return query_vector / norm if norm > 0 else None
+
+    def search_exact(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Brute-force cosine search over every document embedding.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            top_n (int): Top n results to return. Defaults to 10.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        query_vector = self.embed_query(query_terms)
+        if query_vector is None:
+            return []
+
+        rows = numpy.arange(len(self.doc_ids))
+        return self._top_n(rows, self.embeddings @ query_vector, top_n)
+
+    def search(self, query_terms: List[str], top_n: int = 10, n_probe: int = None) -> List[Tuple[str, float]]:
+        """
+        Approximate cosine search scanning only the closest IVF clusters.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            top_n (int): Top n results to return. Defaults to 10.
+            n_probe (int, optional): Clusters to scan. Defaults to self.n_probe.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        query_vector = self.embed_query(query_terms)
+        if query_vector is None:
+            return []
+
+        n_probe = min(n_probe or self.n_probe, len(self.inverted_lists))
+        closest = numpy.argsort(self.centroids @ query_vector)[::-1][:n_probe]
+        rows = numpy.concatenate([self.inverted_lists[cluster] for cluster in closest])
+
+        return self._top_n(rows, self.embeddings[rows] @ query_vector, top_n)
+
+    def _top_n(self, rows, scores, top_n: int) -> List[Tuple[str, float]]:
+        """Pick the top n (row, score) pairs and map rows back to document IDs"""
+        if top_n <= 0:
+            return []
+
+        if len(scores) > top_n:
+            best = numpy.argpartition(scores, -top_n)[-top_n:]
+        else:
+            best = numpy.arange(len(scores))
+
+        best = best[numpy.argsort(scores[best])[::-1]]
+        return [(self.doc_ids[rows[i]], float(scores[i])) for i in best]
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / numpy.where(norms > 0, norms, 1)).astype(numpy.float32)
+
+
+class HybridRetrieval:
+    """Fuses BM25 and dense scores with a weighted sum of min-max normalized scores"""
+
+    def __init__(self, bm25: OkapiBM25, dense: DenseRetrieval, alpha: float = 0.5, depth: int = 100):
+        self.bm25 = bm25
+        self.dense = dense
+        self.alpha = alpha  # Weight of the dense score, (1 - alpha) goes to BM25
+        self.depth = depth  # Results taken from each model before fusing
+
+    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Search using both models and fuse the scores.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            top_n (int): Top n results to return. Defaults to 10.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        depth = max(self.depth, top_n)
+        lexical = self._min_max(self.bm25.search(query_terms, depth))
+        dense = self._min_max(self.dense.search(query_terms, depth))
+
+        # Documents missing from one model's list get that model's lowest score
+        scores = []
+        for doc_id in lexical.keys() | dense.keys():
+            score = self.alpha * dense.get(doc_id, 0) + (1 - self.alpha) * lexical.get(doc_id, 0)
+            scores.append((doc_id, score))
+
+        scores.sort(key=lambda x: x[1], reverse=True)
+        return scores[:top_n]
+
+    @staticmethod
+    def _min_max(results: List[Tuple[str, float]]) -> Dict[str, float]:
+        if not results:
+            return {}
+
+        low = min(score for _, score in results)
+        high = max(score for _, score in results)
+        span = high - low
+        return {doc_id: (score - low) / span if span > 0 else 1.0 for doc_id, score in results}
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import threading
+import tempfile
+import json
+import zlib
+import os
+
+class DocumentStore:
+    """Compressed on-disk store for raw document text with an LRU block cache"""
+
+    def __init__(self, path: str = None, block_size: int = 16, cache_blocks: int = 64):
+        self.path = path  # None keeps the store in an anonymous file removed on close/exit
+        self.block_size = block_size  # Documents per compressed block
+        self.cache_blocks = cache_blocks  # Max number of decompressed blocks held in memory
+        self.block_offsets: List[Tuple[int, int]] = []  # (offset, length) of each block in the file
+        self.locations: Dict[str, Tuple[int, int]] = {}  # doc_id -> (block number, slot in block)
+        self.block_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file = open(path, 'w+b') if path is not None else tempfile.TemporaryFile()
+
+    def add(self, doc_id: str, text: str):
+        """Append a document, compressing a block whenever enough documents are buffered"""
+        self.locations[doc_id] = (len(self.block_offsets), len(self._pending))
+        self._pending.append(text)
+
+        if len(self._pending) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """Write any buffered documents to disk as a compressed block"""
+        if not self._pending:
+            return
+
+        data = zlib.compress(json.dumps(self._pending).encode('utf-8'))
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+
+        self.block_offsets.append((offset, len(data)))
+        self._pending = []
+
+    def load_block(self, block_no: int) -> List[str]:
+        """Return the documents of a block, decompressing it on a cache miss"""
+        with self._lock:
+            if block_no in self.block_cache:
+                self.cache_hits += 1
+                self.block_cache.move_to_end(block_no)
+                return self.block_cache[block_no]
+
+            self.cache_misses += 1
+
+        # Positioned read, concurrent readers never move a shared file offset
+        offset, length = self.block_offsets[block_no]
+        block = json.loads(zlib.decompress(os.pread(self._file.fileno(), length, offset)).decode('utf-8'))
+
+        with self._lock:
+            self.block_cache[block_no] = block
+            if len(self.block_cache) > self.cache_blocks:
+                # Evict the least recently used block
+                self.block_cache.popitem(last=False)
+
+        return block
+
+    def get(self, doc_id: str, default: str = "") -> str:
+        """Get the raw text of a document"""
+        if doc_id not in self.locations:
+            return default
+
+        block_no, slot = self.locations[doc_id]
+        if block_no == len(self.block_offsets):
+            # Document is still buffered and has not been written yet
+            return self._pending[slot]
+
+        return self.load_block(block_no)[slot]
+
+    def cache_stats(self) -> Dict[str, float]:
+        """Get block cache hit/miss counts and hit ratio"""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_ratio': self.cache_hits / lookups if lookups else 0
+        }
+
+    def close(self):
+        """Close the underlying file"""
+        self._file.close()
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.locations
+
+    def __len__(self) -> int:
+        return len(self.locations)
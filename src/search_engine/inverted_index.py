@@ -1,3 +1,4 @@
+from search_engine.postings_cache import TieredPostings
 from collections import defaultdict, Counter
 from typing import List, Dict, Set
 
@@ -8,6 +9,7 @@ class InvertedIndex:
         self.index = defaultdict(list)
         self.doc_lengths = {}
         self.doc_terms = defaultdict(Counter)
+        self.doc_frequencies = {}
         self.total_docs = 0
         self.avg_doc_length = 0
 
@@ -31,6 +33,18 @@ class InvertedIndex:
 
             self.avg_doc_length = total_length / self.total_docs if self.total_docs > 0 else 0
 
+        # Kept separately so document frequencies never need the postings
+        self.doc_frequencies = {term: len(set(doc_id for doc_id, _ in postings))
+                                for term, postings in self.index.items()}
+
+    def offload(self, budget_bytes: int, path: str = None):
+        """
+        Move postings to disk, keeping only the hottest terms' postings in memory.
+
+        Only takes effect after build, which holds every posting in memory first.
+        """
+        self.index = TieredPostings(self.index, self.doc_lengths.keys(), budget_bytes, path)
+
     def get_docs_containing(self, term: str) -> Set[str]:
         """Get document IDs containing the given term"""
         return set(doc_id for doc_id, _ in self.index.get(term, []))
@@ -41,4 +55,4 @@ class InvertedIndex:
 
     def get_doc_frequency(self, term: str) -> int:
         """Get the number of documents containing the given term"""
-        return len(set(doc_id for doc_id, _ in self.index.get(term, [])))
\ No newline at end of file
+        return self.doc_frequencies.get(term, 0)
\ No newline at end of file
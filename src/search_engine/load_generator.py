@@ -0,0 +1,493 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict
+from typing import List, Tuple, Dict
+from textwrap import dedent
+import multiprocessing
+import threading
+import queue
+import argparse
+import resource
+import random
+import numpy
+import time
+import os
+
+from search_engine.main import SearchEngine, SearchEvaluator
+from search_engine.downloader import download_datasets
+from search_engine.postings_cache import TieredPostings
+
+
+def read_query_log(path: str, default_method: str = 'bm25') -> List[Tuple[str, str]]:
+    """
+    Read a query log with one query per line, optionally prefixed by a method and a tab.
+
+    Returns:
+        List of (method, query) tuples.
+
+    Raises:
+        ValueError: If a line names a method the engine does not support.
+    """
+
+    queries = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line_no, line in enumerate(f, 1):
+            fields = line.rstrip('\n').split('\t')
+            query = fields[-1].strip()
+            if not query:
+                continue
+
+            method = fields[0].strip() if len(fields) > 1 else default_method
+            if method not in SearchEngine.METHODS:
+                raise ValueError(f"Unknown method '{method}' on line {line_no} of '{path}'")
+            queries.append((method, query))
+
+    return queries
+
+
+def synthesize_queries(seed_queries: List[str], n: int, method: str = 'bm25', zipf_s: float = 1.1,
+                       seed: int = 42) -> List[Tuple[str, str]]:
+    """
+    Synthesize a query stream where query popularity follows a Zipf distribution.
+
+    Args:
+        seed_queries (List[str]): Distinct queries to draw from, e.g. CISI queries and corpus words.
+        n (int): Number of queries to generate.
+        method (str): Retrieval method of every query. Defaults to 'bm25'.
+        zipf_s (float): Zipf exponent, higher means a heavier head. Defaults to 1.1.
+        seed (int): Random seed. Defaults to 42.
+
+    Returns:
+        List of (method, query) tuples.
+    """
+
+    rng = random.Random(seed)
+    pool = list(dict.fromkeys(seed_queries))
+    rng.shuffle(pool)
+
+    # The query at popularity rank r is drawn with probability proportional to 1/r^s
+    weights = [1 / rank ** zipf_s for rank in range(1, len(pool) + 1)]
+    return [(method, query) for query in rng.choices(pool, weights, k=n)]
+
+
+def current_rss_bytes(pid: str = 'self') -> int:
+    """Get the resident set size of a process, this one's peak if the current one is unavailable"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoadGenerator:
+    """Replays queries against a SearchEngine and measures throughput and latency"""
+
+    # Cache stats that accumulate over the engine's lifetime, reported per run as differences
+    CACHE_COUNTERS = ('hits', 'misses', 'evictions')
+
+    def __init__(self, engine: SearchEngine, top_n: int = 10, interval: float = 1.0):
+        self.engine = engine
+        self.top_n = top_n
+        self.interval = interval  # Seconds per reporting window
+        self._lock = threading.Lock()
+        self._records = []
+        self._errors = Counter()  # 'ExceptionType: message' -> occurrences
+        self._cache_stats = None
+
+    def _execute(self, method: str, query: str, arrival: float):
+        """Run one query, latency counts from its arrival so queueing delay is included"""
+        error = None
+        try:
+            self.engine.search(query, method=method, top_n=self.top_n)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        finished = time.perf_counter()
+        with self._lock:
+            if error is not None:
+                self._errors[error] += 1
+            else:
+                self._records.append((finished, (finished - arrival) * 1000))
+
+    def run_open_loop(self, queries: List[Tuple[str, str]], rate: float,
+                      max_workers: int = 8) -> Dict:
+        """
+        Send queries at a fixed target rate, regardless of how fast they complete.
+
+        Args:
+            queries (List[Tuple[str, str]]): (method, query) tuples.
+            rate (float): Target queries per second.
+            max_workers (int): Threads executing queries. Defaults to 8.
+
+        Returns:
+            Report dictionary, see build_report.
+        """
+
+        return self._run(lambda: self._dispatch_open_loop(queries, rate, max_workers), rate=rate)
+
+    def _dispatch_open_loop(self, queries: List[Tuple[str, str]], rate: float, max_workers: int):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, (method, query) in enumerate(queries):
+                arrival = start + i / rate
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._execute, method, query, arrival)
+
+    def run_closed_loop(self, queries: List[Tuple[str, str]], concurrency: int) -> Dict:
+        """
+        Keep a fixed number of queries in flight, each worker sending its next query
+        as soon as the previous one completes.
+
+        Args:
+            queries (List[Tuple[str, str]]): (method, query) tuples.
+            concurrency (int): Number of concurrent workers.
+
+        Returns:
+            Report dictionary, see build_report.
+        """
+
+        return self._run(lambda: self._dispatch_closed_loop(queries, concurrency), concurrency=concurrency)
+
+    def _dispatch_closed_loop(self, queries: List[Tuple[str, str]], concurrency: int):
+        remaining = iter(queries)
+        remaining_lock = threading.Lock()
+
+        def worker():
+            while True:
+                with remaining_lock:
+                    item = next(remaining, None)
+                if item is None:
+                    return
+                self._execute(item[0], item[1], time.perf_counter())
+
+        workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def run_multi_process(self, queries: List[Tuple[str, str]], processes: int, concurrency: int) -> Dict:
+        """
+        Closed loop across several worker processes forked from this one, each with
+        its own copy-on-write engine and concurrency threads. Unlike threads, this
+        uses several cores and exercises caches shared between processes.
+
+        Args:
+            queries (List[Tuple[str, str]]): (method, query) tuples, dealt round robin to the processes.
+            processes (int): Number of worker processes.
+            concurrency (int): Closed loop workers per process.
+
+        Returns:
+            Report dictionary, see build_report. Memory is the sum over the workers,
+            pages they still share with this process are counted once per worker.
+            Queries of a worker that dies before reporting are counted as errors.
+        """
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        shares = [queries[i::processes] for i in range(processes)]
+        workers = []
+        reported_rss = []
+
+        def worker(worker_no):
+            # Counters inherited from this process are not part of the worker's run
+            caches_before = self.cache_stats()
+            self._dispatch_closed_loop(shares[worker_no], concurrency)
+            results.put((worker_no, self._records, self._errors,
+                         self.cache_delta(caches_before, self.cache_stats()), current_rss_bytes()))
+
+        def dispatch():
+            for worker_no in range(processes):
+                process = context.Process(target=worker, args=(worker_no,))
+                process.start()
+                workers.append(process)
+
+            # Drain the queue before joining, a worker blocks until its results are read
+            cache_stats = []
+            pending = set(range(processes))
+            while pending:
+                try:
+                    worker_no, records, errors, caches, rss = results.get(timeout=self.interval)
+                except queue.Empty:
+                    # Anything a worker put before exiting is readable by now, so an exited
+                    # worker still pending died before reporting (e.g. killed for memory)
+                    for worker_no in [n for n in pending if workers[n].exitcode is not None]:
+                        error = f"WorkerLost: process exited with code {workers[worker_no].exitcode} before reporting"
+                        self._errors[error] += len(shares[worker_no])
+                        pending.discard(worker_no)
+                    continue
+
+                self._records.extend(records)
+                self._errors.update(errors)
+                cache_stats.append(caches)
+                reported_rss.append(rss)
+                pending.discard(worker_no)
+
+            for process in workers:
+                process.join()
+
+            self._cache_stats = self.merge_cache_stats(cache_stats)
+
+        def workers_rss():
+            alive = [process for process in workers if process.is_alive()]
+            if alive:
+                return sum(current_rss_bytes(str(process.pid)) for process in alive)
+            # Once they exited, fall back to what the workers measured just before reporting
+            return sum(reported_rss) if reported_rss else None
+
+        return self._run(dispatch, rss=workers_rss, processes=processes, concurrency=concurrency)
+
+    @classmethod
+    def cache_delta(cls, before: Dict[str, Dict[str, float]],
+                    after: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        """Cache stats of a run from snapshots taken before and after it"""
+        delta = {}
+        for name, stats in after.items():
+            stats = dict(stats)
+            for stat in cls.CACHE_COUNTERS:
+                if stat in stats:
+                    stats[stat] -= before.get(name, {}).get(stat, 0)
+
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+            delta[name] = stats
+
+        return delta
+
+    @staticmethod
+    def merge_cache_stats(per_process: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+        """Sum the cache counters of several processes"""
+        merged = defaultdict(lambda: defaultdict(float))
+        for caches in per_process:
+            for name, stats in caches.items():
+                for stat, value in stats.items():
+                    if stat == 'occupancy':
+                        # A property of the one shared table, not a per process count
+                        merged[name][stat] = max(merged[name][stat], value)
+                    elif stat != 'hit_ratio':
+                        merged[name][stat] += value
+
+        for stats in merged.values():
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+
+        return {name: dict(stats) for name, stats in merged.items()}
+
+    def _run(self, dispatch, rss=current_rss_bytes, **settings) -> Dict:
+        """Run a dispatcher while sampling memory, then build the report"""
+        self._records = []
+        self._errors = Counter()
+        self._cache_stats = None
+        memory_samples = []
+        done = threading.Event()
+        caches_before = self.cache_stats()
+
+        def sample_memory():
+            while not done.is_set():
+                sample = rss()
+                if sample is not None:
+                    memory_samples.append((time.perf_counter(), sample))
+                done.wait(self.interval)
+
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        dispatch()
+        end = time.perf_counter()
+        done.set()
+        sampler.join()
+        sample = rss()
+        if sample is not None:
+            memory_samples.append((end, sample))
+
+        if self._cache_stats is None:
+            self._cache_stats = self.cache_delta(caches_before, self.cache_stats())
+
+        return self.build_report(start, end, memory_samples, settings)
+
+    def build_report(self, start: float, end: float, memory_samples: List[Tuple[float, int]],
+                     settings: Dict) -> Dict:
+        """
+        Summarize a run.
+
+        Returns:
+            Dictionary with overall throughput and latency percentiles, the cache hit
+            rates over the run and a timeline of per-window throughput, p99 latency and
+            memory, None for windows before the first memory sample.
+        """
+
+        latencies = numpy.array([latency for _, latency in self._records])
+        elapsed = end - start
+
+        timeline = []
+        for window_start in numpy.arange(start, end, self.interval):
+            window_end = window_start + self.interval
+            window = [latency for finished, latency in self._records if window_start <= finished < window_end]
+            memory = [rss for sampled, rss in memory_samples if sampled < window_end]
+            timeline.append({
+                'time_s': window_start - start,
+                'qps': len(window) / self.interval,
+                'p99_ms': float(numpy.percentile(window, 99)) if window else 0.0,
+                'rss_mb': memory[-1] / 2 ** 20 if memory else None
+            })
+
+        report = dict(settings)
+        report.update({
+            'queries': len(self._records),
+            'errors': sum(self._errors.values()),
+            'top_errors': self._errors.most_common(5),
+            'duration_s': elapsed,
+            'throughput_qps': len(self._records) / elapsed if elapsed > 0 else 0.0,
+            'caches': self._cache_stats,
+            'timeline': timeline
+        })
+        for name, percentile in [('p50_ms', 50), ('p90_ms', 90), ('p99_ms', 99), ('max_ms', 100)]:
+            report[name] = float(numpy.percentile(latencies, percentile)) if len(latencies) else 0.0
+
+        return report
+
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        """Collect hit rates of the engine's caches that are enabled"""
+        caches = {}
+        if self.engine.query_cache is not None:
+            caches['Query analysis'] = self.engine.query_cache.stats()
+        if self.engine.rm3 is not None:
+            caches['RM3 feedback'] = self.engine.rm3.cache_stats()
+        if isinstance(self.engine.inverted_index.index, TieredPostings):
+            caches['Postings'] = self.engine.inverted_index.index.stats()
+        return caches
+
+    def sweep(self, queries: List[Tuple[str, str]], rates: List[float], max_workers: int = 8) -> List[Dict]:
+        """Run the open loop at increasing rates to find the saturation point"""
+        return [self.run_open_loop(queries, rate, max_workers) for rate in rates]
+
+    @staticmethod
+    def print_report(report: Dict):
+        """Print a run report"""
+        if 'rate' in report:
+            mode = f"rate {report['rate']:.1f} q/s"
+        elif 'processes' in report:
+            mode = f"{report['processes']} processes x concurrency {report['concurrency']}"
+        else:
+            mode = f"concurrency {report['concurrency']}"
+        print(dedent(f"""
+        {'=' * 80}
+        Replay - {mode}
+        {'=' * 80}
+        Queries: {report['queries']} ({report['errors']} errors) in {report['duration_s']:.2f}s
+        Throughput: {report['throughput_qps']:.2f} q/s
+        Latency (ms): p50={report['p50_ms']:.2f} p90={report['p90_ms']:.2f} p99={report['p99_ms']:.2f} max={report['max_ms']:.2f}
+        {'-' * 80}
+        {'Time (s)':<12} {'Throughput':<14} {'p99 (ms)':<12} {'RSS (MB)':<12}
+        {'-' * 80}"""))
+
+        for window in report['timeline']:
+            rss = f"{window['rss_mb']:.1f}" if window['rss_mb'] is not None else 'N/A'
+            print(f"{window['time_s']:<12.1f} "
+                  f"{window['qps']:<14.2f} "
+                  f"{window['p99_ms']:<12.2f} "
+                  f"{rss:<12}")
+
+        if report['top_errors']:
+            print(f"{'-' * 80}")
+            for error, count in report['top_errors']:
+                print(f"{count:>6}x {error}")
+
+        print(f"{'-' * 80}")
+        for name, stats in report['caches'].items():
+            line = (f"{name} cache: hit ratio {stats['hit_ratio']:.3f} "
+                    f"({stats['hits']:.0f} hits, {stats['misses']:.0f} misses")
+            if 'evictions' in stats:
+                line += f", {stats['evictions']:.0f} evictions, {stats['resident_bytes'] / 2 ** 20:.1f} MB resident"
+            print(line + ")")
+        print(f"{'=' * 80}\n")
+
+    @staticmethod
+    def print_saturation_curve(reports: List[Dict]):
+        """Print offered vs achieved throughput and latency for a rate sweep"""
+        print(dedent(f"""
+        {'=' * 80}
+        Saturation Curve
+        {'=' * 80}
+        {'Offered (q/s)':<16} {'Achieved (q/s)':<16} {'p50 (ms)':<12} {'p99 (ms)':<12} {'Errors':<8}
+        {'-' * 80}"""))
+
+        for report in reports:
+            print(f"{report['rate']:<16.1f} "
+                  f"{report['throughput_qps']:<16.2f} "
+                  f"{report['p50_ms']:<12.2f} "
+                  f"{report['p99_ms']:<12.2f} "
+                  f"{report['errors']:<8}")
+        print(f"{'=' * 80}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or synthesize query traffic against the search engine")
+    parser.add_argument('--dataset', choices=['reuters', 'cisi'], default='reuters')
+    parser.add_argument('--sample-size', type=int, default=1000, help="Reuters documents to index")
+    parser.add_argument('--log', help="Query log to replay, one '[method<TAB>]query' per line")
+    parser.add_argument('--synthesize', type=int, default=1000,
+                        help="Queries to synthesize from CISI queries and Reuters words when no log is given")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of synthesized queries")
+    parser.add_argument('--method', choices=SearchEngine.METHODS, default='bm25',
+                        help="Retrieval method of synthesized queries and of log lines without one")
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--rate', type=float, nargs='+',
+                        help="Open loop target rate(s) in q/s, several rates produce a saturation curve")
+    parser.add_argument('--concurrency', type=int, default=4, help="Closed loop workers when no rate is given")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Worker processes for the closed loop, each running --concurrency threads")
+    parser.add_argument('--workers', type=int, default=8, help="Threads executing open loop queries")
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds per reporting window")
+    parser.add_argument('--query-cache', help="Shared query cache file, enables the query analysis cache")
+    parser.add_argument('--postings-budget', type=float,
+                        help="Memory budget in MB for decoded postings, keeps the rest on disk")
+    parser.add_argument('--reranker-model', help="Trained re-ranker to load, the untrained defaults otherwise")
+    args = parser.parse_args()
+    if args.rate and args.processes > 1:
+        parser.error("--processes only applies to the closed loop, drop --rate")
+
+    cisi_path = download_datasets()
+    engine = SearchEngine(reranker_model=args.reranker_model)
+    if args.dataset == 'reuters':
+        engine.build_index_from_reuters(args.sample_size)
+    else:
+        engine.build_index_from_cisi(cisi_path)
+
+    if args.log:
+        try:
+            queries = read_query_log(args.log, args.method)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        from nltk.corpus import reuters
+
+        # Head of the Reuters vocabulary as single word queries, plus the long CISI queries
+        words = Counter(word.lower() for word in reuters.words(reuters.fileids()[:args.sample_size])
+                        if word.isalpha() and word.lower() not in engine.processor.stop_words)
+        cisi_queries = SearchEvaluator.parse_cisi_queries(os.path.join(cisi_path, 'CISI.QRY'))
+        seed_queries = [word for word, _ in words.most_common(2000)] + list(cisi_queries.values())
+        queries = synthesize_queries(seed_queries, args.synthesize, args.method, args.zipf)
+
+    if args.query_cache:
+        engine.enable_query_cache(args.query_cache)
+    if args.postings_budget is not None:
+        engine.limit_index_memory(int(args.postings_budget * 2 ** 20))
+
+    generator = LoadGenerator(engine, args.top_n, args.interval)
+    if args.rate:
+        reports = generator.sweep(queries, args.rate, args.workers)
+        for report in reports:
+            generator.print_report(report)
+        if len(reports) > 1:
+            generator.print_saturation_curve(reports)
+    elif args.processes > 1:
+        generator.print_report(generator.run_multi_process(queries, args.processes, args.concurrency))
+    else:
+        generator.print_report(generator.run_closed_loop(queries, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from typing import List, Tuple, Set, Dict
 from collections import defaultdict
 from textwrap import dedent
 import numpy
+import time
 import os
 
 from search_engine.downloader import download_datasets
@@ -11,38 +12,54 @@ from search_engine.inverted_index import InvertedIndex
 from search_engine.boolean_retrieval import BooleanRetrieval
 from search_engine.vector_space_model import VectorSpaceModel
 from search_engine.okapi_bm25 import OkapiBM25
+from search_engine.document_store import DocumentStore
+from search_engine.snippet_generator import SnippetGenerator
+from search_engine.dense_retrieval import DenseRetrieval, HybridRetrieval
+from search_engine.query_expansion import PseudoRelevanceFeedback
+from search_engine.reranker import RerankingPipeline, LinearReranker, MODEL_PATH
+from search_engine.query_cache import SharedQueryCache
+from search_engine.postings_cache import TieredPostings
 
 
 class SearchEngine:
-    def __init__(self):
+    METHODS = ('boolean', 'vsm', 'bm25', 'dense', 'hybrid', 'rm3', 'rerank')
+
+    def __init__(self, reranker_model: str = None):
         self.processor = TextProcessor()
         self.inverted_index = InvertedIndex()
         self.boolean_retrieval = None
         self.vsm = None
         self.bm25 = None
-        self.raw_documents = {}
-        self.processed_documents = {}
+        self.dense = None
+        self.hybrid = None
+        self.rm3 = None
+        self.reranker = None
+        self.reranker_model = reranker_model  # Trained re-ranker to load, None for the untrained defaults
+        self.query_cache = None
+        self.document_store = DocumentStore()
+        self.snippet_generator = SnippetGenerator(self.document_store, self.inverted_index,
+                                                  self.processor)
 
     def build_index_from_reuters(self, sample_size: int = 1000):
         """Build index from Reuters corpus"""
         print(f"Loading Reuters corpus with a sample size of {sample_size}...")
         file_ids = reuters.fileids()[:sample_size]
 
+        # Processed documents are only needed to build the index, the index keeps what it needs
+        processed_documents = {}
         for file_id in file_ids:
             # Get raw text
             raw_text = reuters.raw(file_id)
-            self.raw_documents[file_id] = raw_text
+            self.document_store.add(file_id, raw_text)
 
             # Process text
             processed = self.processor.process(raw_text)
-            self.processed_documents[file_id] = processed
+            processed_documents[file_id] = processed
 
-        self.inverted_index.build(self.processed_documents)
+        self.document_store.flush()
+        self.inverted_index.build(processed_documents)
 
-        # Initialize retrieval models
-        self.boolean_retrieval = BooleanRetrieval(self.inverted_index)
-        self.vsm = VectorSpaceModel(self.inverted_index)
-        self.bm25 = OkapiBM25(self.inverted_index)
+        self.init_retrieval_models()
 
         print(dedent(f"""
         Index built successfully from Reuters corpus.
@@ -57,17 +74,17 @@ class SearchEngine:
         # Parse CISI documents
         docs = self.parse_cisi_documents(os.path.join(cisi_path, 'CISI.ALL'))
 
+        # Processed documents are only needed to build the index, the index keeps what it needs
+        processed_documents = {}
         for doc_id, raw_text in docs.items():
-            self.raw_documents[doc_id] = raw_text
+            self.document_store.add(doc_id, raw_text)
             processed = self.processor.process(raw_text)
-            self.processed_documents[doc_id] = processed
+            processed_documents[doc_id] = processed
 
-        self.inverted_index.build(self.processed_documents)
+        self.document_store.flush()
+        self.inverted_index.build(processed_documents)
 
-        # Initialize retrieval models
-        self.boolean_retrieval = BooleanRetrieval(self.inverted_index)
-        self.vsm = VectorSpaceModel(self.inverted_index)
-        self.bm25 = OkapiBM25(self.inverted_index)
+        self.init_retrieval_models()
 
         print(dedent(f"""
         Index built successfully from CISI.
@@ -76,6 +93,77 @@ class SearchEngine:
         Average document length: {self.inverted_index.avg_doc_length:.2f} terms
         """))
 
+    def init_retrieval_models(self):
+        """Initialize retrieval models over the built index"""
+        self.boolean_retrieval = BooleanRetrieval(self.inverted_index)
+        self.vsm = VectorSpaceModel(self.inverted_index)
+        self.bm25 = OkapiBM25(self.inverted_index)
+        self.rm3 = PseudoRelevanceFeedback(self.bm25)
+        model = self.load_reranker_model(self.reranker_model) if self.reranker_model else None
+        self.reranker = RerankingPipeline(self.bm25, self.vsm, model)
+
+        # Embeddings are only computed once 'dense' or 'hybrid' is first used
+        self.dense = DenseRetrieval(self.inverted_index, self.vsm)
+        self.hybrid = HybridRetrieval(self.bm25, self.dense)
+
+    @staticmethod
+    def load_reranker_model(path: str):
+        """Load a re-ranker trained offline, None (untrained defaults) if there is none at path"""
+        if not os.path.exists(path):
+            return None
+
+        try:
+            return LinearReranker.load(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Ignoring re-ranker model at '{path}': {e}")
+            return None
+
+    def close(self):
+        """Release the on-disk structures of the engine"""
+        self.document_store.close()
+        if self.dense is not None:
+            self.dense.close()
+        if self.query_cache is not None:
+            self.query_cache.close()
+        if isinstance(self.inverted_index.index, TieredPostings):
+            self.inverted_index.index.close()
+
+    def enable_query_cache(self, path: str = None, warm_log: str = None, **kwargs):
+        """
+        Share analyzed queries with other processes through a memory-mapped cache.
+
+        Args:
+            path (str, optional): Cache file, processes using the same path share entries.
+            warm_log (str, optional): Query log to pre-warm the cache from.
+            **kwargs: Passed on to SharedQueryCache.
+        """
+
+        self.query_cache = SharedQueryCache(self.processor, self.inverted_index.index.keys(), path, **kwargs)
+        if warm_log:
+            warmed = self.query_cache.warm_from_log(warm_log)
+            print(f"Query cache warmed with {warmed} queries")
+
+    def limit_index_memory(self, budget_bytes: int, path: str = None):
+        """
+        Keep postings on disk with only the hottest terms cached in memory.
+
+        This lowers the memory of the running engine, not of building it: the
+        index is built in memory first, so peak memory is that of the full index.
+
+        Args:
+            budget_bytes (int): Memory budget of the decoded postings cache.
+            path (str, optional): Postings file. Defaults to a temporary file.
+        """
+
+        self.inverted_index.offload(budget_bytes, path)
+
+    def analyze_query(self, query: str) -> List[str]:
+        """Process a query, through the shared query cache if enabled"""
+        if self.query_cache is not None:
+            return self.query_cache.analyze(query)
+
+        return self.processor.process(query)
+
     @staticmethod
     def parse_cisi_documents(filepath: str) -> Dict[str, str]:
         """Parse CISI.ALL file and extract documents"""
@@ -122,7 +210,8 @@ class SearchEngine:
 
         Args:
             query (str): Search query string.
-            method (str, optional): 'boolean', 'vsm', 'bm25'. Defaults to 'bm25'.
+            method (str, optional): 'boolean', 'vsm', 'bm25', 'dense', 'hybrid', 'rm3',
+                'rerank'. Defaults to 'bm25'.
             boolean_op (str, optional): 'AND', 'OR', 'NOT'. Defaults to 'AND'.
             top_n (int): Top n results to return. Defaults to 10.
 
@@ -131,7 +220,7 @@ class SearchEngine:
         """
 
         # Process query
-        query_terms = self.processor.process(query)
+        query_terms = self.analyze_query(query)
 
         if not query_terms:
             return []
@@ -146,6 +235,14 @@ class SearchEngine:
                 return self.vsm.search(query_terms, top_n)
             case 'bm25':
                 return self.bm25.search(query_terms, top_n)
+            case 'dense':
+                return self.dense.search(query_terms, top_n)
+            case 'hybrid':
+                return self.hybrid.search(query_terms, top_n)
+            case 'rm3':
+                return self.rm3.search(query_terms, top_n)
+            case 'rerank':
+                return self.reranker.search(query_terms, top_n)
             case _:
                 raise ValueError(f"Unknown method '{method}'")
 
@@ -159,13 +256,11 @@ class SearchEngine:
         Found {len(results)} documents
         {'=' * 80}"""))
 
-        for rank, (doc_id, score) in enumerate(results, 1):
-            raw_text = self.raw_documents.get(doc_id, "")
+        query_terms = self.analyze_query(query)
 
-            # Truncate for display
-            preview = raw_text[:max_length].replace('\n', ' ')
-            if len(raw_text) > max_length:
-                preview += "..."
+        for rank, (doc_id, score) in enumerate(results, 1):
+            # Show the part of the document that best matches the query
+            preview = self.snippet_generator.generate(doc_id, query_terms, max_length)
 
             print(dedent(f"""
             \x1B[32m{rank}. {doc_id}\x1B[0m
@@ -205,10 +300,14 @@ class SearchEvaluator:
 
         return test_queries
 
-    def create_cisi_test_queries(self, cisi_path: str) -> List[Tuple[str, Set[str]]]:
+    def create_cisi_test_queries(self, cisi_path: str, limit: int = 5) -> List[Tuple[str, Set[str]]]:
         """
         Create test queries with relevance judgments for CISI.
 
+        Args:
+            cisi_path (str): Path to the CISI dataset.
+            limit (int, optional): Max number of queries, None for all. Defaults to 5.
+
         Returns:
             List of (query, relevant_doc_ids) tuples.
         """
@@ -221,7 +320,7 @@ class SearchEvaluator:
                 relevant_docs = {f"CISI_{doc_id}" for doc_id in relevance[query_id]}
                 test_queries.append((query_text, relevant_docs))
 
-        return test_queries[:5]
+        return test_queries[:limit]
 
     @staticmethod
     def parse_cisi_queries(filepath: str) -> Dict[str, str]:
@@ -282,11 +381,13 @@ class SearchEvaluator:
         Evaluate a single query.
 
         Returns:
-            Dictionary with precision, recall, F1, and AP.
+            Dictionary with precision, recall, F1, AP and latency (ms).
         """
 
         # Get search results
+        start = time.perf_counter()
         results = self.search_engine.search(query, method=method, top_n=top_n)
+        latency = (time.perf_counter() - start) * 1000
         retrieved_docs = set(doc_id for doc_id, _ in results)
 
         # Calculate metrics
@@ -298,7 +399,17 @@ class SearchEvaluator:
         f1 = (2 * precision * recall / (precision + recall)
               if (precision + recall) > 0 else 0)
 
-        # Calculate Average Precision
+        return {
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'average_precision': self.average_precision(results, relevant_docs),
+            'latency_ms': latency
+        }
+
+    @staticmethod
+    def average_precision(results: List[Tuple[str, float]], relevant_docs: Set[str]) -> float:
+        """Calculate Average Precision of a ranked result list"""
         ap = 0
         relevant_found = 0
         for rank, (doc_id, _) in enumerate(results, 1):
@@ -306,13 +417,68 @@ class SearchEvaluator:
                 relevant_found += 1
                 ap += relevant_found / rank
 
-        ap = ap / len(relevant_docs) if relevant_docs else 0
+        return ap / len(relevant_docs) if relevant_docs else 0
+
+    def train_reranker_cisi(self, cisi_path: str, path: str = MODEL_PATH) -> float:
+        """
+        Train the re-ranker on the CISI queries that are not used for evaluation
+        and save it for engines created with reranker_model=path to load.
+
+        Returns:
+            The final training loss.
+        """
+
+        evaluation_size = len(self.create_cisi_test_queries(cisi_path))
+        training_queries = [
+            (self.search_engine.processor.process(query), relevant_docs)
+            for query, relevant_docs in self.create_cisi_test_queries(cisi_path, limit=None)[evaluation_size:]
+        ]
+
+        loss = self.search_engine.reranker.train(training_queries)
+        self.search_engine.reranker.reranker.save(path)
+        return loss
+
+    def benchmark_dense_cisi(self, cisi_path: str, top_n: int = 10,
+                             probes: Tuple[int, ...] = (1, 2, 4, 8, 16)) -> Dict[str, Dict[str, float]]:
+        """
+        Benchmark approximate dense search against exact brute-force search on CISI.
+
+        Returns:
+            Dictionary with recall against exact search, MAP and mean latency (ms)
+            for the exact search and each number of probed clusters.
+        """
+
+        dense = self.search_engine.dense
+        dense.ensure_built()  # Keep the one-off build out of the latencies
+        test_queries = self.create_cisi_test_queries(cisi_path, limit=None)
+        results = defaultdict(lambda: defaultdict(list))
+
+        for query, relevant_docs in test_queries:
+            query_terms = self.search_engine.processor.process(query)
+
+            start = time.perf_counter()
+            exact = dense.search_exact(query_terms, top_n)
+            results['exact']['latency_ms'].append((time.perf_counter() - start) * 1000)
+            results['exact']['recall_vs_exact'].append(1.0)
+            results['exact']['map'].append(self.average_precision(exact, relevant_docs))
+            exact_docs = set(doc_id for doc_id, _ in exact)
+
+            for n_probe in probes:
+                start = time.perf_counter()
+                approximate = dense.search(query_terms, top_n, n_probe=n_probe)
+                elapsed = (time.perf_counter() - start) * 1000
+
+                approximate_docs = set(doc_id for doc_id, _ in approximate)
+                overlap = len(exact_docs & approximate_docs) / len(exact_docs) if exact_docs else 1.0
+
+                name = f"ivf n_probe={n_probe}"
+                results[name]['latency_ms'].append(elapsed)
+                results[name]['recall_vs_exact'].append(overlap)
+                results[name]['map'].append(self.average_precision(approximate, relevant_docs))
 
         return {
-            'precision': precision,
-            'recall': recall,
-            'f1': f1,
-            'average_precision': ap
+            name: {metric: numpy.mean(values) for metric, values in metrics.items()}
+            for name, metrics in results.items()
         }
 
     def evaluate_all_methods_reuters(self, top_n: int = 10) -> Dict[str, Dict[str, float]]:
@@ -325,9 +491,12 @@ class SearchEvaluator:
 
         test_queries = self.create_reuters_test_queries()
 
-        methods = ['boolean', 'vsm', 'bm25']
+        methods = ['boolean', 'vsm', 'bm25', 'dense', 'hybrid', 'rm3', 'rerank']
         results = {method: defaultdict(list) for method in methods}
 
+        # Keep the one-off dense build out of the latencies
+        self.search_engine.dense.ensure_built()
+
         for query, relevant_docs in test_queries:
             print(f"\x1B[3mEvaluating query: '{query}'\x1B[0m")
 
@@ -342,7 +511,8 @@ class SearchEvaluator:
                     print(dedent(f"""
                     {method.upper()}: P={metrics['precision']:.3f},
                     R={metrics['recall']:.3f}, F1={metrics['f1']:.3f},
-                    AP={metrics['average_precision']:.3f}
+                    AP={metrics['average_precision']:.3f},
+                    Latency={metrics['latency_ms']:.2f}ms
                     """))
             print()
 
@@ -366,9 +536,12 @@ class SearchEvaluator:
 
         test_queries = self.create_cisi_test_queries(cisi_path)
 
-        methods = ['boolean', 'vsm', 'bm25']
+        methods = ['boolean', 'vsm', 'bm25', 'dense', 'hybrid', 'rm3', 'rerank']
         results = {method: defaultdict(list) for method in methods}
 
+        # Keep the one-off dense build out of the latencies
+        self.search_engine.dense.ensure_built()
+
         for query, relevant_docs in test_queries:
             print(f"\x1B[3mEvaluating query: '{query[:50]}...'\x1B[0m")
 
@@ -383,7 +556,8 @@ class SearchEvaluator:
                     print(dedent(f"""
                     {method.upper()}: P={metrics['precision']:.3f},
                     R={metrics['recall']:.3f}, F1={metrics['f1']:.3f},
-                    AP={metrics['average_precision']:.3f}
+                    AP={metrics['average_precision']:.3f},
+                    Latency={metrics['latency_ms']:.2f}ms
                     """))
             print()
 
@@ -404,7 +578,7 @@ class SearchEvaluator:
         {'=' * 80}
         Evaluation Results - {dataset_name}
         {'=' * 80}
-        {'Method':<15} {'Precision':<12} {'Recall':<12} {'F1-Score':<12} {'Avg. Precision':<16}
+        {'Method':<15} {'Precision':<12} {'Recall':<12} {'F1-Score':<12} {'Avg. Precision':<16} {'Latency (ms)':<12}
         {'-' * 80}"""))
 
         for method, metrics in results.items():
@@ -414,19 +588,43 @@ class SearchEvaluator:
                       f"{'N/A':<12} "
                       f"{'N/A':<12} "
                       f"{'N/A':<12} "
-                      f"{'N/A':<15}")
+                      f"{'N/A':<16} "
+                      f"{'N/A':<12}")
             else:
                 print(f"{method.upper():<15} "
                       f"{metrics['precision']:<12.4f} "
                       f"{metrics['recall']:<12.4f} "
                       f"{metrics['f1']:<12.4f} "
-                      f"{metrics['average_precision']:<15.4f}")
+                      f"{metrics['average_precision']:<16.4f} "
+                      f"{metrics['latency_ms']:<12.2f}")
+
+        # Feedback costs an extra retrieval pass, show how much it adds on top of BM25
+        if 'bm25' in results and 'rm3' in results:
+            added = results['rm3']['latency_ms'] - results['bm25']['latency_ms']
+            print(f"{'-' * 80}\nRM3 added latency over BM25: {added:.2f} ms/query")
+        print(f"{'=' * 80}\n")
+
+    @staticmethod
+    def print_dense_benchmark(results: Dict[str, Dict[str, float]]):
+        """Print the dense retrieval benchmark in a formatted table"""
+        print(dedent(f"""
+        {'=' * 80}
+        Dense Retrieval Benchmark - CISI
+        {'=' * 80}
+        {'Search':<20} {'Recall vs exact':<18} {'MAP':<12} {'Latency (ms)':<12}
+        {'-' * 80}"""))
+
+        for name, metrics in results.items():
+            print(f"{name:<20} "
+                  f"{metrics['recall_vs_exact']:<18.4f} "
+                  f"{metrics['map']:<12.4f} "
+                  f"{metrics['latency_ms']:<12.4f}")
         print(f"{'=' * 80}\n")
 
 
 def main():
     cisi_path = download_datasets()
-    engine = SearchEngine()
+    engine = SearchEngine(reranker_model=MODEL_PATH)
     engine.build_index_from_reuters()
 
     while True:
@@ -434,7 +632,9 @@ def main():
         -- Options --
         1. Search
         2. Evaluate all methods
-        3. Exit"""))
+        3. Benchmark dense retrieval (CISI)
+        4. Train re-ranker (CISI)
+        5. Exit"""))
 
         choice = input(">> ").strip()
 
@@ -449,10 +649,15 @@ def main():
                 -- Select retrieval method --
                 1. Boolean
                 2. Vector Space Model (TF-IDF)
-                3. BM25"""))
+                3. BM25
+                4. Dense (LSA embeddings)
+                5. Hybrid (BM25 + Dense)
+                6. BM25 with RM3 query expansion
+                7. BM25 with feature re-ranking"""))
                 method_choice = input(">> ").strip()
 
-                method_map = {'1': 'boolean', '2': 'vsm', '3': 'bm25'}
+                method_map = {'1': 'boolean', '2': 'vsm', '3': 'bm25', '4': 'dense', '5': 'hybrid',
+                              '6': 'rm3', '7': 'rerank'}
                 method = method_map.get(method_choice, 'bm25')
 
                 boolean_op = 'AND'
@@ -479,7 +684,15 @@ def main():
                 engine.display_results(results, query, method)
 
             case '2':
-                # Evaluate all methods on both datasets
+                # Evaluate all methods on both datasets, retraining the re-ranker first so the
+                # results never depend on a model left behind by an earlier run
+                cisi_engine = SearchEngine()
+                cisi_engine.build_index_from_cisi(cisi_path)
+                cisi_evaluator = SearchEvaluator(cisi_engine)
+                loss = cisi_evaluator.train_reranker_cisi(cisi_path)
+                print(f"Re-ranker trained on CISI judgments, loss: {loss:.4f}, saved to '{MODEL_PATH}'")
+                engine.reranker.reranker = engine.load_reranker_model(MODEL_PATH) or LinearReranker()
+
                 print(dedent(f"""
                 {'=' * 80}
                 Evaluating Reuters dataset...
@@ -495,16 +708,32 @@ def main():
                 {'=' * 80}
                 """))
 
-                cisi_engine = SearchEngine()
-                cisi_engine.build_index_from_cisi(cisi_path)
-                cisi_evaluator = SearchEvaluator(cisi_engine)
                 cisi_results = cisi_evaluator.evaluate_all_methods_cisi(cisi_path, top_n=10)
+                cisi_engine.close()
 
                 reuters_evaluator.print_evaluation_results(reuters_results, "Reuters")
                 cisi_evaluator.print_evaluation_results(cisi_results, "CISI")
 
             case '3':
+                cisi_engine = SearchEngine()
+                cisi_engine.build_index_from_cisi(cisi_path)
+                cisi_evaluator = SearchEvaluator(cisi_engine)
+                cisi_evaluator.print_dense_benchmark(cisi_evaluator.benchmark_dense_cisi(cisi_path))
+                cisi_engine.close()
+
+            case '4':
+                cisi_engine = SearchEngine()
+                cisi_engine.build_index_from_cisi(cisi_path)
+                loss = SearchEvaluator(cisi_engine).train_reranker_cisi(cisi_path)
+                cisi_engine.close()
+                print(f"Re-ranker trained on CISI judgments, loss: {loss:.4f}, saved to '{MODEL_PATH}'")
+
+                # Use the new model for Reuters searches too
+                engine.reranker.reranker = engine.load_reranker_model(MODEL_PATH) or LinearReranker()
+
+            case '5':
                 print("\x1B[3mExiting, bye...\x1B[0m")
+                engine.close()
                 break
 
             case _:
@@ -1,5 +1,5 @@
 from search_engine.inverted_index import InvertedIndex
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Set, Counter
 import math
 
 class OkapiBM25:
@@ -53,10 +53,32 @@ class OkapiBM25:
         if not query_terms:
             return []
 
+        # Repeated query terms count once per occurrence
+        return self.search_weighted(Counter(query_terms), top_n)
+
+    def search_weighted(self, query_weights: Dict[str, float], top_n: int = 10,
+                        candidates: Set[str] = None) -> List[Tuple[str, float]]:
+        """
+        Search using BM25 scoring with a weight per query term.
+
+        Args:
+            query_weights (Dict[str, float]): Query terms and their weights.
+            top_n (int): Top n results to return. Defaults to 10.
+            candidates (Set[str], optional): Documents to score. Defaults to every
+                document containing a query term.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        if not query_weights:
+            return []
+
         # Get candidate documents
-        candidates = set()
-        for term in query_terms:
-            candidates.update(self.index.get_docs_containing(term))
+        if candidates is None:
+            candidates = set()
+            for term in query_weights:
+                candidates.update(self.index.get_docs_containing(term))
 
         if not candidates:
             return []
@@ -65,8 +87,8 @@ class OkapiBM25:
         scores = []
         for doc_id in candidates:
             score = 0
-            for term in query_terms:
-                score += self.compute_bm25_score(term, doc_id)
+            for term, weight in query_weights.items():
+                score += weight * self.compute_bm25_score(term, doc_id)
 
             scores.append((doc_id, score))
 
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Iterator
+from array import array
+import threading
+import tempfile
+import zlib
+import sys
+import os
+
+class TieredPostings:
+    """
+    Read-only postings mapping that keeps postings on disk and the hottest terms'
+    decoded postings in memory under a byte budget, evicting the least recently used.
+
+    Supports the dict operations the retrieval models use on InvertedIndex.index.
+    """
+
+    # Approximate memory of one decoded (doc_id, position) posting: the tuple and
+    # the position int, doc_id strings are shared with the document table
+    POSTING_SIZE = sys.getsizeof(('', 0)) + sys.getsizeof(1000)
+
+    def __init__(self, postings: Dict[str, List[Tuple[str, int]]], doc_ids: List[str],
+                 budget_bytes: int, path: str = None):
+        self.doc_ids = list(doc_ids)
+        self.budget_bytes = budget_bytes
+        self.directory = {}  # term -> (offset, length) of its compressed postings in the file
+        self.cache = OrderedDict()  # term -> (postings, size in bytes)
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.path = path  # None keeps the postings in an anonymous file removed on close/exit
+        self._file = open(path, 'w+b') if path is not None else tempfile.TemporaryFile()
+
+        # Postings are stored as flat (doc ordinal, position) uint32 pairs
+        doc_ordinals = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        for term, term_postings in postings.items():
+            encoded = array('I')
+            for doc_id, pos in term_postings:
+                encoded.append(doc_ordinals[doc_id])
+                encoded.append(pos)
+
+            data = zlib.compress(encoded.tobytes())
+            self.directory[term] = (self._file.tell(), len(data))
+            self._file.write(data)
+
+        self._file.flush()
+
+    def decode(self, term: str) -> List[Tuple[str, int]]:
+        """Read and decode the postings of a term from disk"""
+        offset, length = self.directory[term]
+        encoded = array('I')
+        encoded.frombytes(zlib.decompress(os.pread(self._file.fileno(), length, offset)))
+
+        doc_ids = self.doc_ids
+        return [(doc_ids[ordinal], pos) for ordinal, pos in zip(encoded[0::2], encoded[1::2])]
+
+    def get(self, term: str, default=None):
+        """Get the postings of a term, decoding and caching them on a miss"""
+        if term not in self.directory:
+            return default
+
+        with self._lock:
+            if term in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(term)
+                return self.cache[term][0]
+
+            self.misses += 1
+
+        postings = self.decode(term)
+        size = sys.getsizeof(postings) + len(postings) * self.POSTING_SIZE
+        if size > self.budget_bytes:
+            # Would evict everything else, serve it straight from disk
+            return postings
+
+        with self._lock:
+            if term not in self.cache:
+                self.cache[term] = (postings, size)
+                self.resident_bytes += size
+
+            while self.resident_bytes > self.budget_bytes:
+                _, (_, evicted_size) = self.cache.popitem(last=False)
+                self.resident_bytes -= evicted_size
+                self.evictions += 1
+
+        return postings
+
+    def stats(self) -> Dict[str, float]:
+        """Get hit/miss/eviction counts, hit ratio and resident size"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0,
+            'evictions': self.evictions,
+            'resident_terms': len(self.cache),
+            'resident_bytes': self.resident_bytes
+        }
+
+    def close(self):
+        """Close the postings file"""
+        self._file.close()
+
+    def __getitem__(self, term: str) -> List[Tuple[str, int]]:
+        if term not in self.directory:
+            raise KeyError(term)
+        return self.get(term)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.directory
+
+    def __len__(self) -> int:
+        return len(self.directory)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.directory)
+
+    def keys(self):
+        return self.directory.keys()
@@ -0,0 +1,192 @@
+from search_engine.text_processor import TextProcessor
+from typing import List, Dict, Iterable
+import tempfile
+import hashlib
+import struct
+import zlib
+import mmap
+import os
+
+class SharedQueryCache:
+    """
+    Analyzed query cache mapping raw query strings to term ID lists, kept in a
+    memory-mapped file so every process opening the same path shares it. Terms
+    missing from the vocabulary are stored inline after the IDs.
+
+    The table is set associative, each query hashes to a bucket of a few slots and
+    the least recently used slot of the bucket is evicted. Access is lock-free,
+    entries carry a checksum seeded with the writer's vocabulary fingerprint, so a
+    torn entry or one written against another vocabulary is treated as a miss.
+    """
+
+    MAGIC = b'SEQ2'
+    HEADER = struct.Struct('<4sIIII')  # magic, buckets, ways, max terms, clock
+    SLOT_HEADER = struct.Struct('<QIIHH')  # key hash, last used, checksum, term count, payload size
+    UNKNOWN_TERM = 0xFFFFFFFF  # Term ID of terms missing from the vocabulary, stored inline
+
+    def __init__(self, processor: TextProcessor, vocabulary: Iterable[str], path: str = None,
+                 n_buckets: int = 1024, ways: int = 4, max_terms: int = 128):
+        self.processor = processor
+        self.terms = sorted(vocabulary)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.n_buckets = n_buckets
+        self.ways = ways
+        self.max_terms = max_terms  # Queries whose payload outgrows this many IDs are analyzed but not cached
+        self.slot_size = self.SLOT_HEADER.size + 4 * max_terms
+        self.hits = 0
+        self.misses = 0
+
+        # Seeds the entry checksums, entries cached against another vocabulary read as misses
+        self.fingerprint = int.from_bytes(
+            hashlib.blake2b('\n'.join(self.terms).encode('utf-8'), digest_size=8).digest(), 'little')
+
+        self.path = path
+        self.size = self.HEADER.size + n_buckets * ways * self.slot_size
+
+        if path is None:
+            # Private table in an anonymous file, removed by the OS once closed
+            self._file = self._new_table(tempfile.TemporaryFile())
+        else:
+            self._file = self._open_table(path)
+        self._mmap = mmap.mmap(self._file.fileno(), self.size)
+
+    def _new_table(self, f):
+        """Size an empty table in the given file and write its header"""
+        f.truncate(self.size)
+        f.seek(0)
+        f.write(self.HEADER.pack(self.MAGIC, self.n_buckets, self.ways, self.max_terms, 0))
+        f.flush()
+        return f
+
+    def _open_table(self, path: str, attempts: int = 3):
+        """Open the shared table at path, replacing it if it has another layout"""
+        for _ in range(attempts):
+            try:
+                f = open(path, 'r+b')
+            except FileNotFoundError:
+                f = None
+
+            if f is not None:
+                header = f.read(self.HEADER.size)
+                if os.fstat(f.fileno()).st_size == self.size and len(header) == self.HEADER.size and \
+                        self.HEADER.unpack(header)[:4] == (self.MAGIC, self.n_buckets, self.ways, self.max_terms):
+                    return f
+                f.close()
+
+            # Never resize a file other processes may have mapped, build a new one
+            # beside it and swap it in, they keep their (now unlinked) table
+            fd, new_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                            prefix=f".{os.path.basename(path)}.")
+            with os.fdopen(fd, 'w+b') as new:
+                self._new_table(new)
+            os.replace(new_path, path)
+
+        # Another process keeps swapping in a different layout, fall back to a private table
+        return self._new_table(tempfile.TemporaryFile())
+
+    def analyze(self, query: str) -> List[str]:
+        """Get the processed terms of a query, processing and caching them on a miss"""
+
+        key = self._hash(query)
+        bucket = self._bucket_offset(key)
+
+        for way in range(self.ways):
+            offset = bucket + way * self.slot_size
+            slot_key, _, checksum, count, size = self.SLOT_HEADER.unpack_from(self._mmap, offset)
+            if slot_key != key or size < 4 * count or size > 4 * self.max_terms:
+                continue
+
+            payload = self._mmap[offset + self.SLOT_HEADER.size:offset + self.SLOT_HEADER.size + size]
+            if self._checksum(key, payload) != checksum:
+                continue
+
+            self.hits += 1
+            struct.pack_into('<I', self._mmap, offset + 8, self._tick())
+            return self._decode(payload, count)
+
+        self.misses += 1
+        terms = self.processor.process(query)
+        payload = self._encode(terms)
+        if len(payload) <= 4 * self.max_terms:
+            self._store(key, bucket, len(terms), payload)
+
+        return terms
+
+    def warm(self, queries: Iterable[str]) -> int:
+        """Analyze and cache the given queries, returns the number of queries seen"""
+        count = 0
+        for query in queries:
+            query = query.strip()
+            if query:
+                self.analyze(query)
+                count += 1
+
+        return count
+
+    def warm_from_log(self, path: str) -> int:
+        """Pre-warm from a query log with one query per line, optionally after a tab separated prefix"""
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            return self.warm(line.rstrip('\n').split('\t')[-1] for line in f)
+
+    def stats(self) -> Dict[str, float]:
+        """Get this process' hit/miss counts and hit ratio, and the table occupancy"""
+        lookups = self.hits + self.misses
+        used = sum(1 for slot in range(self.n_buckets * self.ways)
+                   if struct.unpack_from('<Q', self._mmap, self.HEADER.size + slot * self.slot_size)[0])
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0,
+            'occupancy': used / (self.n_buckets * self.ways)
+        }
+
+    def close(self):
+        """Unmap and close the underlying file"""
+        self._mmap.close()
+        self._file.close()
+
+    def _encode(self, terms: List[str]) -> bytes:
+        """Pack term IDs, followed by the NUL separated terms missing from the vocabulary"""
+        ids = [self.term_ids.get(term, self.UNKNOWN_TERM) for term in terms]
+        unknown = [term for term in terms if term not in self.term_ids]
+        return struct.pack(f'<{len(ids)}I', *ids) + '\0'.join(unknown).encode('utf-8')
+
+    def _decode(self, payload: bytes, count: int) -> List[str]:
+        """Unpack the terms of an entry written by _encode"""
+        ids = struct.unpack_from(f'<{count}I', payload)
+        unknown = iter(payload[4 * count:].decode('utf-8').split('\0'))
+        return [self.terms[term_id] if term_id != self.UNKNOWN_TERM else next(unknown) for term_id in ids]
+
+    def _store(self, key: int, bucket: int, count: int, payload: bytes):
+        """Write an entry over the least recently used slot of its bucket"""
+        victim = min(range(self.ways), key=lambda way: self.SLOT_HEADER.unpack_from(
+            self._mmap, bucket + way * self.slot_size)[1])
+        offset = bucket + victim * self.slot_size
+
+        # Invalidate the key first and publish it last, so readers never match a half written entry
+        struct.pack_into('<Q', self._mmap, offset, 0)
+        self._mmap[offset + self.SLOT_HEADER.size:offset + self.SLOT_HEADER.size + len(payload)] = payload
+        self.SLOT_HEADER.pack_into(self._mmap, offset, 0, self._tick(), self._checksum(key, payload),
+                                   count, len(payload))
+        struct.pack_into('<Q', self._mmap, offset, key)
+
+    def _tick(self) -> int:
+        """Advance the shared clock used for LRU stamps, races only make eviction less exact"""
+        clock_offset = self.HEADER.size - 4
+        clock = (struct.unpack_from('<I', self._mmap, clock_offset)[0] + 1) & 0xFFFFFFFF
+        struct.pack_into('<I', self._mmap, clock_offset, clock)
+        return clock
+
+    def _bucket_offset(self, key: int) -> int:
+        return self.HEADER.size + (key % self.n_buckets) * self.ways * self.slot_size
+
+    @staticmethod
+    def _hash(query: str) -> int:
+        # Stable across processes, unlike hash(); 0 marks an empty slot
+        key = int.from_bytes(hashlib.blake2b(query.encode('utf-8'), digest_size=8).digest(), 'little')
+        return key or 1
+
+    def _checksum(self, key: int, payload: bytes) -> int:
+        # Term IDs are only meaningful for the vocabulary they were assigned from
+        seed = zlib.crc32(struct.pack('<QQ', key, self.fingerprint))
+        return zlib.crc32(payload, seed)
@@ -0,0 +1,130 @@
+from search_engine.okapi_bm25 import OkapiBM25
+from collections import OrderedDict, defaultdict
+from typing import List, Tuple, Dict, Counter
+import threading
+
+class PseudoRelevanceFeedback:
+    """RM3 pseudo-relevance feedback query expansion on top of BM25"""
+
+    def __init__(self, bm25: OkapiBM25, fb_docs: int = 10, fb_terms: int = 10,
+                 original_weight: float = 0.5, doc_vector_terms: int = 50,
+                 max_df_ratio: float = 0.05, second_pass_depth: int = 100, cache_size: int = 1024):
+        self.bm25 = bm25
+        self.index = bm25.index
+        self.fb_docs = fb_docs  # Feedback documents taken from the first pass
+        self.fb_terms = fb_terms  # Max expansion terms added to the query
+        self.original_weight = original_weight  # RM3 interpolation weight of the original query
+        self.doc_vector_terms = doc_vector_terms  # Terms kept per document vector
+        self.max_df_ratio = max_df_ratio  # Terms in more documents than this are never added
+        self.second_pass_depth = second_pass_depth  # First pass documents re-scored by the second pass
+        self.cache_size = cache_size
+        self.doc_vectors = {}
+        self.feedback_cache = OrderedDict()  # query terms -> (expanded weights, first pass doc_ids)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def doc_vector(self, doc_id: str) -> List[Tuple[str, float]]:
+        """Get the top terms of a document with P(term|doc), computed once per document"""
+        if doc_id not in self.doc_vectors:
+            doc_length = self.index.doc_lengths[doc_id]
+            top_terms = self.index.doc_terms[doc_id].most_common(self.doc_vector_terms)
+            self.doc_vectors[doc_id] = [(term, tf / doc_length) for term, tf in top_terms]
+
+        return self.doc_vectors[doc_id]
+
+    def expand(self, query_terms: List[str]) -> Dict[str, float]:
+        """
+        Expand a query with RM3 using the top BM25 documents as feedback.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+
+        Returns:
+            Dictionary of query term weights.
+        """
+
+        return self.feedback(query_terms)[0]
+
+    def feedback(self, query_terms: List[str]) -> Tuple[Dict[str, float], Tuple[str, ...]]:
+        """
+        Expand a query, also returning the top first pass documents.
+
+        Returns:
+            (query term weights, doc_ids of the top second_pass_depth BM25 documents) tuple.
+        """
+
+        key = tuple(query_terms)
+        with self._lock:
+            if key in self.feedback_cache:
+                self.cache_hits += 1
+                self.feedback_cache.move_to_end(key)
+                return self.feedback_cache[key]
+
+            self.cache_misses += 1
+
+        # Original query model, P(term|query)
+        query_weights = {term: count / len(query_terms) for term, count in Counter(query_terms).items()}
+
+        first_pass = self.bm25.search(query_terms, max(self.fb_docs, self.second_pass_depth))
+        feedback = first_pass[:self.fb_docs]
+        total_score = sum(score for _, score in feedback)
+
+        # Relevance model, P(term|R) = sum over feedback docs of P(term|doc) * P(doc|query)
+        relevance_model = defaultdict(float)
+        if total_score > 0:
+            max_df = self.max_df_ratio * self.index.total_docs
+            for doc_id, score in feedback:
+                for term, p_term in self.doc_vector(doc_id):
+                    if self.index.get_doc_frequency(term) <= max_df:
+                        relevance_model[term] += p_term * score / total_score
+
+        # Keep only the strongest expansion terms, each in at most max_df_ratio of the documents
+        expansion = sorted(relevance_model.items(), key=lambda x: x[1], reverse=True)[:self.fb_terms]
+        expansion_total = sum(weight for _, weight in expansion)
+
+        expanded = {term: self.original_weight * weight for term, weight in query_weights.items()}
+        for term, weight in expansion:
+            expanded[term] = expanded.get(term, 0) + (1 - self.original_weight) * weight / expansion_total
+
+        result = (expanded, tuple(doc_id for doc_id, _ in first_pass))
+        with self._lock:
+            self.feedback_cache[key] = result
+            if len(self.feedback_cache) > self.cache_size:
+                self.feedback_cache.popitem(last=False)
+
+        return result
+
+    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Search using BM25 with the RM3 expanded query.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            top_n (int): Top n results to return. Defaults to 10.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        if not query_terms:
+            return []
+
+        expanded, first_pass = self.feedback(query_terms)
+
+        # Re-score the top first pass documents and those matching an expansion term only,
+        # so the second pass never walks the original terms' full postings again
+        candidates = set(first_pass)
+        for term in expanded.keys() - set(query_terms):
+            candidates.update(self.index.get_docs_containing(term))
+
+        return self.bm25.search_weighted(expanded, top_n, candidates)
+
+    def cache_stats(self) -> Dict[str, float]:
+        """Get feedback cache hit/miss counts and hit ratio"""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_ratio': self.cache_hits / lookups if lookups else 0
+        }
@@ -0,0 +1,324 @@
+from search_engine.vector_space_model import VectorSpaceModel
+from typing import List, Tuple, Set, Dict, Counter
+import numpy
+import json
+import math
+import time
+import os
+
+# Where the re-ranker trained offline on CISI judgments is kept
+MODEL_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'search_engine', 'reranker.json')
+
+class LinearReranker:
+    """Logistic regression over re-ranking features, trained offline on relevance judgments"""
+
+    feature_names = ['first_stage', 'vsm_cosine', 'proximity', 'lead_match', 'coverage', 'doc_length']
+
+    def __init__(self, weights: List[float] = None, bias: float = 0.0):
+        # Until trained, rank mostly by the first stage score
+        self.weights = numpy.array(weights or [1.0, 0.5, 0.3, 0.2, 0.3, 0.0])
+        self.bias = bias
+
+    def score(self, features) -> numpy.ndarray:
+        """Score a (candidates x features) matrix"""
+        return features @ self.weights + self.bias
+
+    def train(self, features, labels, epochs: int = 500, learning_rate: float = 0.5,
+              l2: float = 0.001) -> float:
+        """
+        Fit the weights with batch gradient descent on the logistic loss.
+
+        Args:
+            features: (examples x features) matrix.
+            labels: 1 for relevant and 0 for non-relevant examples.
+            epochs (int): Gradient descent iterations. Defaults to 500.
+            learning_rate (float): Step size. Defaults to 0.5.
+            l2 (float): L2 regularization strength. Defaults to 0.001.
+
+        Returns:
+            The final training loss.
+        """
+
+        features = numpy.asarray(features, dtype=numpy.float64)
+        labels = numpy.asarray(labels, dtype=numpy.float64)
+
+        # Relevant documents are rare, weigh them up so they are not ignored
+        positives = max(labels.sum(), 1)
+        sample_weights = numpy.where(labels > 0, len(labels) / (2 * positives),
+                                     len(labels) / (2 * max(len(labels) - positives, 1)))
+
+        weights = numpy.zeros(features.shape[1])
+        bias = 0.0
+        loss = 0.0
+        for _ in range(epochs):
+            predictions = 1 / (1 + numpy.exp(-(features @ weights + bias)))
+            error = sample_weights * (predictions - labels) / len(labels)
+
+            weights -= learning_rate * (features.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum()
+
+            loss = -numpy.mean(sample_weights * (labels * numpy.log(predictions + 1e-12)
+                                                 + (1 - labels) * numpy.log(1 - predictions + 1e-12)))
+
+        self.weights = weights
+        self.bias = bias
+        return float(loss)
+
+    def save(self, path: str):
+        """Save the model weights as JSON"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'features': self.feature_names, 'weights': self.weights.tolist(),
+                       'bias': self.bias}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'LinearReranker':
+        """Load model weights saved with save()"""
+        with open(path, 'r', encoding='utf-8') as f:
+            model = json.load(f)
+
+        if model['features'] != cls.feature_names:
+            raise ValueError(f"Model at '{path}' was trained on different features")
+
+        return cls(model['weights'], model['bias'])
+
+
+class RerankingPipeline:
+    """Two-stage retrieval, a cheap first stage followed by a feature based re-ranker"""
+
+    def __init__(self, first_stage, vsm: VectorSpaceModel, reranker: LinearReranker = None,
+                 first_stage_k: int = 1000, rerank_k: int = 100, first_stage_fallback_ms: float = None,
+                 rerank_budget_ms: float = None, rerank_batch_size: int = 50, lead_length: int = 20):
+        self.first_stage = first_stage  # Any model with search(query_terms, top_n), e.g. OkapiBM25
+        self.vsm = vsm
+        self.index = vsm.index
+        self.reranker = reranker or LinearReranker()
+        self.first_stage_k = first_stage_k  # Candidates retrieved by the first stage
+        self.rerank_k = rerank_k  # Top candidates passed on to the re-ranker
+        # Not a cap on the first stage, which always runs to completion: when it took longer
+        # than this, re-ranking is skipped and the first stage ranking is returned
+        self.first_stage_fallback_ms = first_stage_fallback_ms
+        self.rerank_budget_ms = rerank_budget_ms  # Stop re-scoring further batches once spent
+        self.rerank_batch_size = rerank_batch_size  # Candidates re-scored between budget checks
+        self.lead_length = lead_length  # Leading positions treated as the title/lead field
+        self.doc_norms = None
+
+    def compute_doc_norms(self) -> Dict[str, float]:
+        """Compute the TF-IDF norm of every document once"""
+        if self.doc_norms is None:
+            # Filled locally and published whole, concurrent callers never see a partial dict
+            doc_norms = {}
+            for doc_id, term_counts in self.index.doc_terms.items():
+                norm = sum(((1 + math.log(tf)) * self.vsm.compute_idf(term)) ** 2
+                           for term, tf in term_counts.items())
+                doc_norms[doc_id] = math.sqrt(norm)
+
+            self.doc_norms = doc_norms
+
+        return self.doc_norms
+
+    def extract_features(self, query_terms: List[str], candidates: List[Tuple[str, float]],
+                         top_score: float = None, positional: Tuple[numpy.ndarray, numpy.ndarray] = None):
+        """
+        Compute the re-ranking features of each candidate.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            candidates (List[Tuple[str, float]]): First stage (doc_id, score) tuples.
+            top_score (float, optional): First stage score to normalize by. Defaults to the
+                highest score among the candidates.
+            positional (Tuple[numpy.ndarray, numpy.ndarray], optional): Proximity and lead match
+                of the candidates from positional_features. Computed from the postings if omitted.
+
+        Returns:
+            (candidates x features) matrix, columns as in LinearReranker.feature_names.
+        """
+
+        doc_ids = [doc_id for doc_id, _ in candidates]
+        terms = list(Counter(query_terms).keys())
+
+        # Candidate x query term frequency matrix, the rest is computed in bulk
+        tf = numpy.array([[self.index.doc_terms[doc_id].get(term, 0) for term in terms]
+                          for doc_id in doc_ids], dtype=numpy.float64)
+        idf = numpy.array([self.vsm.compute_idf(term) for term in terms])
+        query_tf = numpy.array(list(Counter(query_terms).values()), dtype=numpy.float64)
+
+        first_stage = numpy.array([score for _, score in candidates])
+        top_score = first_stage.max() if top_score is None else top_score
+        first_stage = first_stage / top_score if top_score > 0 else first_stage
+
+        # Cosine similarity with the same TF-IDF weighting as the VSM
+        query_vector = (1 + numpy.log(query_tf)) * idf
+        doc_tfidf = numpy.where(tf > 0, 1 + numpy.log(numpy.maximum(tf, 1)), 0) * idf
+        doc_norms = self.compute_doc_norms()
+        norms = numpy.array([doc_norms[doc_id] for doc_id in doc_ids]) * numpy.linalg.norm(query_vector)
+        vsm_cosine = numpy.divide(doc_tfidf @ query_vector, norms, out=numpy.zeros(len(doc_ids)),
+                                  where=norms > 0)
+
+        coverage = (tf > 0).sum(axis=1) / len(terms)
+
+        lengths = numpy.array([self.index.doc_lengths[doc_id] for doc_id in doc_ids], dtype=numpy.float64)
+        doc_length = numpy.log1p(lengths / self.index.avg_doc_length) if self.index.avg_doc_length else lengths
+
+        proximity, lead_match = positional if positional is not None else self.positional_features(terms, doc_ids)
+
+        return numpy.column_stack([first_stage, vsm_cosine, proximity, lead_match, coverage, doc_length])
+
+    def positional_features(self, terms: List[str], doc_ids: List[str]):
+        """
+        Compute the proximity and lead field match features from term positions.
+
+        Gathers the candidates' query term positions in a single pass over the
+        postings, then computes the features for all candidates at once.
+        """
+
+        rows = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        matches = []  # (candidate row, position, term number) of each query term occurrence
+        for term_no, term in enumerate(terms):
+            for doc_id, pos in self.index.index.get(term, []):
+                row = rows.get(doc_id)
+                if row is not None:
+                    matches.append((row, pos, term_no))
+
+        if not matches:
+            return numpy.zeros(len(doc_ids)), numpy.zeros(len(doc_ids))
+
+        matches = numpy.array(matches)
+        matches = matches[numpy.lexsort((matches[:, 1], matches[:, 0]))]
+        row, pos, term = matches.T
+
+        present = numpy.zeros((len(doc_ids), len(terms)), dtype=bool)
+        present[row, term] = True
+        lead = numpy.zeros_like(present)
+        in_lead = pos < self.lead_length
+        lead[row[in_lead], term[in_lead]] = True
+
+        # Smallest window containing every matched query term. The window ending at an
+        # occurrence starts at the earliest of the latest occurrences so far of the
+        # document's matched terms, if they have all occurred yet
+        occurrence = numpy.arange(len(matches))
+        start = pos.copy()
+        complete = numpy.ones(len(matches), dtype=bool)
+        for term_no in range(len(terms)):
+            latest = numpy.maximum.accumulate(numpy.where(term == term_no, occurrence, -1))
+            seen = (latest >= 0) & (row[numpy.maximum(latest, 0)] == row)
+            needed = present[row, term_no]
+            complete &= seen | ~needed
+            start = numpy.where(needed & seen, numpy.minimum(start, pos[numpy.maximum(latest, 0)]), start)
+
+        best = numpy.full(len(doc_ids), numpy.inf)
+        numpy.minimum.at(best, row[complete], (pos - start + 1)[complete])
+
+        distinct = present.sum(axis=1)
+        proximity = numpy.where(distinct >= 2, distinct / best, 0.0)
+        lead_match = lead.sum(axis=1) / len(terms)
+        return proximity, lead_match
+
+    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Retrieve candidates with the first stage and re-rank the top ones.
+
+        Args:
+            query_terms (List[str]): List of query terms.
+            top_n (int): Top n results to return. Defaults to 10.
+
+        Returns:
+            List of (doc_id, score) tuples.
+        """
+
+        return self.search_with_timings(query_terms, top_n)[0]
+
+    def search_with_timings(self, query_terms: List[str],
+                            top_n: int = 10) -> Tuple[List[Tuple[str, float]], Dict[str, float]]:
+        """
+        Search, also reporting how long each stage took.
+
+        Candidates the re-rank budget did not reach keep their first stage order after
+        the re-ranked ones, their first stage scores shifted below the lowest re-ranked
+        score so the returned scores stay in descending order.
+
+        Returns:
+            (results, timings) where timings has 'first_stage_ms', 'rerank_ms' and
+            'reranked', the number of candidates the re-ranker scored.
+        """
+
+        timings = {'first_stage_ms': 0.0, 'rerank_ms': 0.0, 'reranked': 0}
+        if not query_terms or top_n <= 0:
+            return [], timings
+
+        start = time.perf_counter()
+        candidates = self.first_stage.search(query_terms, max(self.first_stage_k, top_n))
+        timings['first_stage_ms'] = (time.perf_counter() - start) * 1000
+
+        if not candidates:
+            return [], timings
+
+        if self.first_stage_fallback_ms is not None and timings['first_stage_ms'] > self.first_stage_fallback_ms:
+            # First stage was slow, fall back to its ranking
+            return candidates[:top_n], timings
+
+        self.compute_doc_norms()
+
+        start = time.perf_counter()
+        head = candidates[:max(self.rerank_k, top_n)]
+        top_score = head[0][1]
+
+        # Positions are gathered for the whole head at once, not per batch
+        proximity, lead_match = self.positional_features(list(Counter(query_terms).keys()),
+                                                         [doc_id for doc_id, _ in head])
+
+        scored = []
+        for batch_start in range(0, len(head), self.rerank_batch_size):
+            batch_end = batch_start + self.rerank_batch_size
+            batch = head[batch_start:batch_end]
+            features = self.extract_features(query_terms, batch, top_score,
+                                             (proximity[batch_start:batch_end], lead_match[batch_start:batch_end]))
+            scores = self.reranker.score(features)
+            scored.extend((doc_id, float(score)) for (doc_id, _), score in zip(batch, scores))
+
+            elapsed = (time.perf_counter() - start) * 1000
+            if self.rerank_budget_ms is not None and elapsed > self.rerank_budget_ms:
+                break
+
+        scored.sort(key=lambda x: x[1], reverse=True)
+        timings['rerank_ms'] = (time.perf_counter() - start) * 1000
+        timings['reranked'] = len(scored)
+
+        tail = candidates[len(scored):top_n]
+        if tail:
+            # Re-ranker and first stage scores are on different scales, keep the tail's
+            # first stage gaps but start it just below the lowest re-ranked score
+            below = math.nextafter(scored[-1][1], -math.inf)
+            tail = [(doc_id, below - (tail[0][1] - score)) for doc_id, score in tail]
+
+        return (scored + tail)[:top_n], timings
+
+    def train(self, training_queries: List[Tuple[List[str], Set[str]]], **kwargs) -> float:
+        """
+        Train the re-ranker on first stage candidates of queries with relevance judgments.
+
+        Args:
+            training_queries (List[Tuple[List[str], Set[str]]]): (query terms, relevant doc_ids) tuples.
+            **kwargs: Passed on to LinearReranker.train.
+
+        Returns:
+            The final training loss.
+        """
+
+        features = []
+        labels = []
+        for query_terms, relevant_docs in training_queries:
+            if not query_terms:
+                continue
+
+            candidates = self.first_stage.search(query_terms, self.rerank_k)
+            if not candidates:
+                continue
+
+            features.append(self.extract_features(query_terms, candidates))
+            labels.extend(1 if doc_id in relevant_docs else 0 for doc_id, _ in candidates)
+
+        if not features:
+            return 0.0
+
+        return self.reranker.train(numpy.vstack(features), labels, **kwargs)
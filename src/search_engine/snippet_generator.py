@@ -0,0 +1,92 @@
+from search_engine.document_store import DocumentStore
+from search_engine.inverted_index import InvertedIndex
+from search_engine.text_processor import TextProcessor
+from typing import List
+
+class SnippetGenerator:
+    """Query-biased snippet generation with highlighted query terms"""
+
+    def __init__(self, document_store: DocumentStore, inverted_index: InvertedIndex,
+                 processor: TextProcessor, highlight: str = '\x1B[1;33m', reset: str = '\x1B[0m'):
+        self.store = document_store
+        self.index = inverted_index
+        self.processor = processor
+        self.highlight = highlight
+        self.reset = reset
+
+    def generate(self, doc_id: str, query_terms: List[str], max_length: int = 200) -> str:
+        """
+        Build a snippet from the window of the document that best matches the query.
+
+        Args:
+            doc_id (str): Document to build the snippet for.
+            query_terms (List[str]): Processed query terms.
+            max_length (int): Maximum snippet length in characters. Defaults to 200.
+
+        Returns:
+            The snippet with query terms highlighted.
+        """
+
+        raw_text = self.store.get(doc_id)
+        if not raw_text:
+            return ""
+
+        # Only look for terms the index says are actually in the document
+        doc_terms = self.index.doc_terms.get(doc_id, {})
+        wanted = {term for term in query_terms if term in doc_terms}
+
+        matches = []
+        if wanted:
+            matches = [(term, start, end)
+                       for term, start, end in self.processor.process_with_spans(raw_text)
+                       if term in wanted]
+
+        if not matches:
+            # Nothing to bias towards, fall back to the beginning of the document
+            return self._render(raw_text, 0, min(len(raw_text), max_length), [])
+
+        # Slide a window of max_length characters over the matches, preferring
+        # windows with the most distinct query terms and then the most hits
+        best = (0, 0, 0, 0)  # (distinct, hits, first match, last match)
+        j = 0
+        for i in range(len(matches)):
+            j = max(j, i)
+            while j + 1 < len(matches) and matches[j + 1][2] - matches[i][1] <= max_length:
+                j += 1
+
+            window = matches[i:j + 1]
+            candidate = (len({term for term, _, _ in window}), len(window), i, j)
+            if candidate[:2] > best[:2]:
+                best = candidate
+
+        _, _, first, last = best
+        start, end = matches[first][1], matches[last][2]
+
+        # Pad the window with surrounding context up to max_length
+        padding = max(0, max_length - (end - start))
+        start = max(0, start - padding // 2)
+        end = min(len(raw_text), start + max(max_length, end - start))
+
+        return self._render(raw_text, start, end, matches[first:last + 1])
+
+    def _render(self, raw_text: str, start: int, end: int, matches: list) -> str:
+        """Cut the text to [start, end) and highlight the given matches"""
+        parts = []
+        cursor = start
+        for _, match_start, match_end in matches:
+            if match_start < cursor or match_end > end:
+                continue
+
+            parts.append(raw_text[cursor:match_start])
+            parts.append(f"{self.highlight}{raw_text[match_start:match_end]}{self.reset}")
+            cursor = match_end
+
+        parts.append(raw_text[cursor:end])
+
+        snippet = ''.join(parts).replace('\n', ' ')
+        if start > 0:
+            snippet = "..." + snippet
+        if end < len(raw_text):
+            snippet += "..."
+
+        return snippet
@@ -1,7 +1,8 @@
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.stem import PorterStemmer
-from typing import List
+from typing import List, Tuple
+import re
 
 class TextProcessor:
     """Handles text preprocessing"""
@@ -21,4 +22,18 @@ class TextProcessor:
         # Stem tokens
         tokens = [self.stemmer.stem(token) for token in tokens]
 
-        return tokens
\ No newline at end of file
+        return tokens
+
+    def process_with_spans(self, text: str) -> List[Tuple[str, int, int]]:
+        """Process text keeping the character offsets of each surviving token"""
+        spans = []
+
+        # Alphanumeric runs, so offsets map straight back into the raw text
+        for match in re.finditer(r'[^\W_]+', text):
+            token = match.group().lower()
+            if token in self.stop_words:
+                continue
+
+            spans.append((self.stemmer.stem(token), match.start(), match.end()))
+
+        return spans